@@ -1,5 +1,8 @@
 import os
 import logging
+import asyncio
+from pathlib import Path
+from cachetools import TTLCache
 from telegram import Update
 from telegram.ext import (
     ApplicationBuilder, 
@@ -18,8 +21,26 @@ from video_processor import (
 # Configure logger
 logger = logging.getLogger(__name__)
 
-# Dictionary to store video paths per user
-user_videos = {}
+class UserVideoCache(TTLCache):
+    """TTLCache of video paths per user that deletes a user's files on eviction."""
+    
+    def popitem(self):
+        user_id, video_paths = super().popitem()
+        clean_user_videos(user_id, video_paths)
+        return user_id, video_paths
+    
+    def expire(self, time=None):
+        expired = super().expire(time)
+        for user_id, video_paths in expired:
+            clean_user_videos(user_id, video_paths)
+        return expired
+
+# Video paths per user, dropped after an hour without uploads
+user_videos = UserVideoCache(maxsize=10_000, ttl=3600)
+
+async def expire_user_videos(context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Periodically evict idle users so their files are cleaned up."""
+    user_videos.expire()
 
 async def start_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Send a welcome message when the command /start is issued."""
@@ -63,10 +84,10 @@ async def handle_video(update: Update, context: ContextTypes.DEFAULT_TYPE) -> No
         video_file = await update.message.video.get_file()
         file_path = await store_video(video_file, user_id)
         
-        # Update user's video list
-        if user_id not in user_videos:
-            user_videos[user_id] = []
-        user_videos[user_id].append(file_path)
+        # Update user's video list, re-assigning it to refresh the idle timeout
+        videos = user_videos.get(user_id, [])
+        videos.append(file_path)
+        user_videos[user_id] = videos
         
         # Inform the user
         await status_message.edit_text(
@@ -85,13 +106,21 @@ async def merge_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> N
     """Merge the videos when the command /merge is issued."""
     user_id = update.effective_user.id
     
+    # Take the user's videos out of the cache so they can't expire, and be
+    # cleaned up, while the merge is still using them
+    videos = user_videos.pop(user_id, [])
+    
     # Check if the user has uploaded any videos
-    if user_id not in user_videos or len(user_videos[user_id]) < 2:
+    if len(videos) < 2:
+        if videos:
+            user_videos[user_id] = videos
         await update.message.reply_text(
             "⚠️ Please send at least 2 videos before merging."
         )
         return
     
+    result_path = None
+    
     try:
         # Inform user that merging has started
         status_message = await update.message.reply_text(
@@ -100,26 +129,30 @@ async def merge_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> N
         )
         
         # Process the videos
-        result_path = await merge_videos(user_videos[user_id], user_id)
+        result_path = await merge_videos(videos, user_id)
         
         # Send the result back to the user
         await status_message.edit_text("✅ Merge complete! Sending your video...")
         
-        # Send the merged video
-        with open(result_path, "rb") as video_file:
-            await update.message.reply_video(
-                video=video_file,
-                caption="🎬 Here's your merged video with watermark!"
-            )
+        # Read the merged video off the event loop, then send it
+        video_bytes = await asyncio.to_thread(Path(result_path).read_bytes)
+        await update.message.reply_video(
+            video=video_bytes,
+            filename=Path(result_path).name,
+            caption="🎬 Here's your merged video with watermark!"
+        )
         
         # Clean up the user's videos
-        clean_user_videos(user_id, user_videos[user_id], result_path)
-        user_videos[user_id] = []
-        
-        await status_message.edit_text("✅ Your videos have been merged and sent!")
+        clean_user_videos(user_id, videos, result_path)
         
     except Exception as e:
         logger.error(f"Error merging videos: {e}")
+        
+        # Drop an unsent result and put the videos back, ahead of any
+        # uploaded meanwhile, so the user can retry
+        if result_path:
+            clean_user_videos(user_id, [], result_path)
+        user_videos[user_id] = videos + user_videos.get(user_id, [])
         await update.message.reply_text(
             "❌ There was an error merging your videos. Please try again or /reset and start over."
         )
@@ -151,6 +184,9 @@ def create_bot():
     application.add_handler(CommandHandler("merge", merge_command))
     application.add_handler(CommandHandler("reset", reset_command))
     
+    # Evict idle users every 10 minutes
+    application.job_queue.run_repeating(expire_user_videos, interval=600)
+    
     # Add message handlers
     application.add_handler(MessageHandler(filters.VIDEO, handle_video))
     
@@ -1,9 +1,15 @@
 import os
+import json
+import hashlib
 import uuid
 import subprocess
 import logging
 import asyncio
 from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+
+from cachetools import LRUCache
+from PIL import Image, ImageDraw, ImageFont
 
 # Configure logger
 logger = logging.getLogger(__name__)
@@ -20,150 +26,553 @@ FONT_SIZE = 20
 FONT_COLOR = "white"
 POSITION = "bottom-right"  # Options: center, bottom-right, top-left, etc.
 
+def _query_ffmpeg(option):
+    """Return the output of an FFmpeg listing option such as -encoders."""
+    try:
+        result = subprocess.run(
+            ["ffmpeg", "-hide_banner", option],
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+            timeout=10
+        )
+    except (OSError, subprocess.SubprocessError) as e:
+        logger.warning(f"Could not query FFmpeg {option}: {e}")
+        return b""
+    
+    return result.stdout
+
+# Upper bound on concurrent ffmpeg processes; consumer NVIDIA cards limit
+# the number of simultaneous NVENC sessions
+_ENCODE_SEM = asyncio.Semaphore(int(os.getenv("MAX_CONCURRENT_FFMPEG", "2")))
+
+# Separate, small bound for ffprobe so a merge of many uploads can't fork a
+# process per video at once, without queueing probes behind long encodes
+_PROBE_SEM = asyncio.Semaphore(int(os.getenv("MAX_CONCURRENT_FFPROBE", "4")))
+
+# Concat demuxer reading its list from stdin; entries are absolute file paths
+CONCAT_INPUT_ARGS = ["-f", "concat", "-safe", "0", "-protocol_whitelist", "file,pipe"]
+
+# Render node used by the VAAPI and QSV encoders on Intel/AMD hosts
+DRI_RENDER_NODE = "/dev/dri/renderD128"
+VAAPI_DEVICE_ARGS = ["-vaapi_device", DRI_RENDER_NODE]
+QSV_DEVICE_ARGS = [
+    "-init_hw_device", f"qsv=hw,child_device={DRI_RENDER_NODE}",
+    "-filter_hw_device", "hw"
+]
+
+def _encoder_works(encoder_args, device_args=()):
+    """Run a tiny trial encode to confirm an encoder can actually be used.
+    
+    FFmpeg builds list hardware encoders whether or not the device exists, so a
+    listed encoder alone doesn't mean it will work on this host.
+    """
+    cmd = [
+        "ffmpeg", "-hide_banner", "-v", "error",
+        *device_args,
+        # NVENC rejects frames narrower than ~145px on many GPUs
+        "-f", "lavfi", "-i", "color=s=256x256:d=0.1",
+        *encoder_args,
+        "-f", "null", "-"
+    ]
+    
+    try:
+        result = subprocess.run(
+            cmd,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+            timeout=30
+        )
+    except (OSError, subprocess.SubprocessError) as e:
+        logger.warning(f"Trial encode failed to run: {e}")
+        return False
+    
+    return result.returncode == 0
+
+def _detect_hw_encoder():
+    """Pick the best available H.264 encoder: nvenc, vaapi, qsv or cpu."""
+    encoders = _query_ffmpeg("-encoders")
+    
+    if b"h264_nvenc" in encoders and _encoder_works(["-c:v", "h264_nvenc"]):
+        return "nvenc"
+    
+    if os.path.exists(DRI_RENDER_NODE):
+        if b"h264_vaapi" in encoders and _encoder_works(
+            ["-vf", "format=nv12,hwupload", "-c:v", "h264_vaapi"], VAAPI_DEVICE_ARGS
+        ):
+            return "vaapi"
+        if b"h264_qsv" in encoders and _encoder_works(
+            ["-vf", "format=nv12,hwupload=extra_hw_frames=64", "-c:v", "h264_qsv"], QSV_DEVICE_ARGS
+        ):
+            return "qsv"
+    
+    return "cpu"
+
+# Detected on the first encode rather than at import, so processes that never
+# encode (e.g. the web worker) don't pay for the trial encodes
+_HW_ENCODER = None
+_HAS_CUDA_FILTERS = False
+_HW_DETECT_LOCK = asyncio.Lock()
+
+async def _get_hw_encoder():
+    """Return the detected encoder, running detection once on first use."""
+    global _HW_ENCODER, _HAS_CUDA_FILTERS
+    
+    async with _HW_DETECT_LOCK:
+        if _HW_ENCODER is None:
+            filters = await asyncio.to_thread(_query_ffmpeg, "-filters")
+            _HAS_CUDA_FILTERS = b"overlay_cuda" in filters and b"scale_cuda" in filters
+            _HW_ENCODER = await asyncio.to_thread(_detect_hw_encoder)
+            logger.info(f"Video encoder: {_HW_ENCODER}, CUDA filters available: {_HAS_CUDA_FILTERS}")
+    
+    return _HW_ENCODER
+
+def _load_font():
+    """Load the watermark font, falling back to Pillow's built-in font.
+    
+    Returns the font and a name identifying it, so images rendered with the
+    fallback are regenerated once FONT_PATH becomes available.
+    """
+    try:
+        return ImageFont.truetype(FONT_PATH, FONT_SIZE), FONT_PATH
+    except OSError as e:
+        logger.warning(f"Could not load font {FONT_PATH}, using default font: {e}")
+        return ImageFont.load_default(size=FONT_SIZE), "default"
+
+def _render_text_png(text):
+    """Rasterize watermark text and its drop shadow into a transparent PNG.
+    
+    The file name is derived from the text and font settings, so an existing
+    image is reused until one of them changes.
+    """
+    font, font_name = _load_font()
+    key = hashlib.sha1(f"{text}|{font_name}|{FONT_SIZE}|{FONT_COLOR}".encode()).hexdigest()[:12]
+    png_path = TEMP_DIR / f"wm_{key}.png"
+    
+    if png_path.exists():
+        return png_path
+    
+    _, _, right, bottom = font.getbbox(text)
+    shadow_offset = 2
+    
+    image = Image.new("RGBA", (right + shadow_offset, bottom + shadow_offset), (0, 0, 0, 0))
+    draw = ImageDraw.Draw(image)
+    draw.text((shadow_offset, shadow_offset), text, font=font, fill="black")
+    draw.text((0, 0), text, font=font, fill=FONT_COLOR)
+    image.save(png_path)
+    
+    logger.info(f"Rendered watermark image {png_path}")
+    return png_path
+
+# Rendered once so ffmpeg overlays pixels instead of rasterizing glyphs per frame
+WATERMARK_PNG = _render_text_png(WATERMARK_TEXT)
+EMAIL_PNG = _render_text_png(EMAIL_TEXT)
+
+# Files created per user that are still on disk; users with nothing left
+# are removed, so cleanup never has to rescan the directory
+user_files: dict[int, set[str]] = {}
+
+# Users whose temp directory is known to exist; forgotten on cleanup so the
+# set only holds users with files on disk
+_created_dirs: set[int] = set()
+
+def _user_dir(user_id):
+    """Return the user's temp directory, creating it on first use only."""
+    user_dir = TEMP_DIR / str(user_id)
+    if user_id not in _created_dirs:
+        user_dir.mkdir(exist_ok=True)
+        _created_dirs.add(user_id)
+    return user_dir
+
+def _track_file(user_id, path):
+    """Record a file created for a user so clean_user_videos can remove it."""
+    user_files.setdefault(user_id, set()).add(str(path))
+
 async def store_video(telegram_file, user_id):
     """Download and store a video file from Telegram."""
     # Create user-specific directory if it doesn't exist
-    user_dir = TEMP_DIR / str(user_id)
-    user_dir.mkdir(exist_ok=True)
+    user_dir = _user_dir(user_id)
     
     # Generate a unique filename
     file_path = user_dir / f"{uuid.uuid4()}.mp4"
     
-    # Download the file
-    await telegram_file.download_to_drive(str(file_path))
+    # Download the file, removing any partial download on failure
+    _track_file(user_id, file_path)
+    try:
+        await telegram_file.download_to_drive(str(file_path))
+    except Exception:
+        clean_user_videos(user_id, [file_path])
+        raise
     
     logger.info(f"Stored video for user {user_id} at {file_path}")
     return str(file_path)
 
-async def apply_watermark(input_path, output_path):
-    """Apply watermark to a video using FFmpeg."""
+# Probed video stream parameters keyed by file path; uploaded files never
+# change, so entries stay valid until cleanup drops them
+_probe_cache = LRUCache(maxsize=1024)
+
+async def probe_video_stream(path):
+    """Return the codec parameters of the first video stream in a file."""
+    if path in _probe_cache:
+        return _probe_cache[path]
+    
+    cmd = [
+        "ffprobe",
+        "-v", "error",
+        "-select_streams", "v:0",
+        "-show_entries", "stream=codec_name,width,height,r_frame_rate,pix_fmt",
+        "-of", "json",
+        path
+    ]
+    
+    async with _PROBE_SEM:
+        process = await asyncio.create_subprocess_exec(
+            *cmd,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE
+        )
+        
+        stdout, stderr = await process.communicate()
+    
+    if process.returncode != 0:
+        logger.error(f"FFprobe error: {stderr.decode()}")
+        raise Exception(f"Failed to probe {path}")
+    
+    streams = json.loads(stdout).get("streams", [])
+    params = None
+    if streams:
+        stream = streams[0]
+        params = (
+            stream.get("codec_name"),
+            stream.get("width"),
+            stream.get("height"),
+            stream.get("r_frame_rate"),
+            stream.get("pix_fmt"),
+        )
+    
+    _probe_cache[path] = params
+    return params
+
+async def uniform_stream_params(video_paths):
+    """Return the video codec parameters shared by all videos, or None if they differ."""
+    # Probe concurrently so process start-up costs overlap instead of adding up
+    params = set(await asyncio.gather(*(probe_video_stream(path) for path in video_paths)))
+    return params.pop() if len(params) == 1 else None
+
+def _nvdec_can_decode(stream_params):
+    """Check whether probed stream parameters are safe to decode into CUDA frames.
+    
+    Only 8-bit 4:2:0 H.264/HEVC is assumed; other formats (4:2:2, 10-bit,
+    AV1, VP9) are unsupported on many GPUs and ffmpeg would silently decode
+    them in software, which breaks a filter graph expecting CUDA frames.
+    """
+    if not stream_params:
+        return False
+    
+    codec_name, _, _, _, pix_fmt = stream_params
+    return codec_name in ("h264", "hevc") and pix_fmt in ("yuv420p", "yuvj420p", "nv12")
+
+async def apply_watermark(input_path, output_path, concat_list=None, renditions=None, encoder=None,
+                          stream_params=None):
+    """Apply watermark to a video using FFmpeg.
+    
+    When concat_list is given, it is an ffmpeg concat list written to the
+    process's stdin, input_path should be "pipe:0", and the listed videos are
+    joined and watermarked in a single pass.
+    
+    renditions is an optional list of (resolution, bitrate, output_path)
+    tuples, e.g. ("1280x720", "2M", path), encoded from the same decode pass
+    alongside the full resolution output_path.
+    
+    encoder defaults to the one detected on first use; if a hardware encode
+    fails, the watermark is retried once with libx264.
+    
+    stream_params are the probed input parameters; NVENC only decodes on the
+    GPU when they describe a format NVDEC supports.
+    """
+    encoder = encoder or await _get_hw_encoder()
+    
+    # The filter graph is passed to ffmpeg as a script next to the output
+    filter_script = Path(output_path).with_name(f"filter_{uuid.uuid4()}.txt")
+    
     try:
         # Define watermark position coordinates based on the POSITION setting
         position_map = {
-            "center": "x=(w-text_w)/2:y=(h-text_h)/2",
-            "bottom": "x=(w-text_w)/2:y=h-th-10",
-            "bottom-right": "x=w-tw-10:y=h-th-10",
+            "center": "x=(W-w)/2:y=(H-h)/2",
+            "bottom": "x=(W-w)/2:y=H-h-10",
+            "bottom-right": "x=W-w-10:y=H-h-10",
             "top-left": "x=10:y=10",
-            "top-right": "x=w-tw-10:y=10",
+            "top-right": "x=W-w-10:y=10",
         }
         
-        position_coords = position_map.get(POSITION, "x=w-tw-10:y=h-th-10")  # Default to bottom-right
+        position_coords = position_map.get(POSITION, "x=W-w-10:y=H-h-10")  # Default to bottom-right
+        
+        email_coords = "x=(W-w)/2:y=10"
         
-        # Create filter for watermark text at bottom-right and email at top center
-        # Use separate quotes for FFmpeg text to avoid escape issues
-        filter_text = f"drawtext=text='{WATERMARK_TEXT}':fontfile={FONT_PATH}:" \
-                     f"{position_coords}:fontcolor={FONT_COLOR}:fontsize={FONT_SIZE}:" \
-                     f"shadowcolor=black:shadowx=2:shadowy=2"
+        # Overlay the pre-rendered watermark at POSITION and email at top center
+        overlays = f"[1:v]overlay={position_coords}:format=auto[wm];" \
+                   f"[wm][2:v]overlay={email_coords}:format=auto"
         
-        # Add email text at top center
-        filter_text += f", drawtext=text='{EMAIL_TEXT}':fontfile={FONT_PATH}:" \
-                      f"x=(w-text_w)/2:y=10:fontcolor={FONT_COLOR}:fontsize={FONT_SIZE}:" \
-                      f"shadowcolor=black:shadowx=2:shadowy=2"
+        # Build FFmpeg command, using the GPU encoder when available
+        if encoder == "nvenc" and not _nvdec_can_decode(stream_params):
+            # Decode and overlay in software; NVENC accepts system memory frames
+            input_args = []
+            filter_graph = f"[0:v]{overlays}[wmk]"
+            scale_filter = "scale"
+            finish_filter = "format=yuv420p"
+            output_args = [
+                "-c:v", "h264_nvenc",
+                "-preset", "p4",
+                "-tune", "hq",
+                "-rc", "vbr"
+            ]
+            bitrate = "4M"
+        elif encoder == "nvenc":
+            # Decode on NVDEC and keep frames in CUDA memory for NVENC
+            input_args = [
+                "-init_hw_device", "cuda=gpu",
+                "-filter_hw_device", "gpu",
+                "-hwaccel", "cuda",
+                "-hwaccel_device", "gpu",
+                "-hwaccel_output_format", "cuda"
+            ]
+            if _HAS_CUDA_FILTERS:
+                # Upload the watermark images once and overlay them on the GPU
+                filter_graph = f"[1:v]format=yuva420p,hwupload_cuda[wm_src];" \
+                               f"[2:v]format=yuva420p,hwupload_cuda[email_src];" \
+                               f"[0:v]scale_cuda=format=yuv420p[base];" \
+                               f"[base][wm_src]overlay_cuda={position_coords}[wm];" \
+                               f"[wm][email_src]overlay_cuda={email_coords}[wmk]"
+                scale_filter = "scale_cuda"
+                finish_filter = None
+            else:
+                # Overlay on system memory frames, then upload back to CUDA
+                filter_graph = f"[0:v]hwdownload,format=nv12[base];[base]{overlays}[wmk]"
+                scale_filter = "scale"
+                finish_filter = "hwupload_cuda"
+            output_args = [
+                "-c:v", "h264_nvenc",
+                "-preset", "p4",
+                "-tune", "hq",
+                "-rc", "vbr"
+            ]
+            bitrate = "4M"
+        elif encoder == "vaapi":
+            # Overlay on system memory frames, then upload to the VAAPI device
+            input_args = VAAPI_DEVICE_ARGS
+            filter_graph = f"[0:v]{overlays}[wmk]"
+            scale_filter = "scale"
+            finish_filter = "format=nv12,hwupload"
+            output_args = ["-c:v", "h264_vaapi"]
+            bitrate = "4M"
+        elif encoder == "qsv":
+            # Overlay on system memory frames, then upload to the QSV device
+            input_args = QSV_DEVICE_ARGS
+            filter_graph = f"[0:v]{overlays}[wmk]"
+            scale_filter = "scale"
+            finish_filter = "format=nv12,hwupload=extra_hw_frames=64"
+            output_args = [
+                "-c:v", "h264_qsv",
+                "-preset", "veryfast"
+            ]
+            bitrate = "4M"
+        else:
+            # Favour encode speed over compression; keyframes every 48
+            # frames keep the output seekable
+            input_args = []
+            filter_graph = f"[0:v]{overlays}[wmk]"
+            scale_filter = "scale"
+            finish_filter = None
+            output_args = [
+                "-c:v", "libx264",
+                "-preset", "ultrafast",
+                "-tune", "zerolatency",
+                "-x264-params", "keyint=48:min-keyint=48"
+            ]
+            bitrate = None
+        
+        if concat_list is not None:
+            input_args = [*CONCAT_INPUT_ARGS, *input_args]
+        
+        # Split the watermarked stream so every rendition shares one decode
+        outputs = [(None, bitrate, output_path), *(renditions or [])]
+        if len(outputs) > 1:
+            split_labels = "".join(f"[split{i}]" for i in range(len(outputs)))
+            filter_graph += f";[wmk]split={len(outputs)}{split_labels}"
+            source_labels = [f"split{i}" for i in range(len(outputs))]
+        else:
+            source_labels = ["wmk"]
+        
+        output_cmd = []
+        for i, (resolution, output_bitrate, path) in enumerate(outputs):
+            chain = []
+            if resolution:
+                chain.append(f"{scale_filter}={resolution.replace('x', ':')}")
+            if finish_filter:
+                chain.append(finish_filter)
+            filter_graph += f";[{source_labels[i]}]{','.join(chain) or 'null'}[out{i}]"
+            
+            output_cmd += [
+                "-map", f"[out{i}]",
+                "-map", "0:a?",
+                *output_args,
+                *(["-b:v", output_bitrate] if output_bitrate else []),
+                "-codec:a", "copy",
+                "-movflags", "+faststart",  # Put the moov atom first so players can start early
+                str(path)
+            ]
+        
+        # Write the graph to a file so ffmpeg parses it without command line quoting
+        filter_script.write_text(filter_graph)
         
-        # Build FFmpeg command
         cmd = [
             "ffmpeg",
+            *input_args,
             "-i", input_path,
-            "-vf", filter_text,
-            "-codec:a", "copy",
+            "-i", str(WATERMARK_PNG),
+            "-i", str(EMAIL_PNG),
+            "-filter_complex_script", str(filter_script),
             "-y",  # Overwrite output files without asking
-            output_path
+            *output_cmd
         ]
         
         # Run the FFmpeg command
         logger.info(f"Applying watermark to {input_path}")
-        process = await asyncio.create_subprocess_exec(
-            *cmd,
-            stdout=asyncio.subprocess.PIPE,
-            stderr=asyncio.subprocess.PIPE
-        )
-        
-        stdout, stderr = await process.communicate()
+        async with _ENCODE_SEM:
+            process = await asyncio.create_subprocess_exec(
+                *cmd,
+                stdin=asyncio.subprocess.PIPE if concat_list is not None else None,
+                stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.PIPE
+            )
+            
+            stdout, stderr = await process.communicate(input=concat_list)
         
         if process.returncode != 0:
+            if encoder != "cpu":
+                logger.warning(f"FFmpeg {encoder} watermark error, retrying on CPU: {stderr.decode()}")
+                return await apply_watermark(
+                    input_path, output_path, concat_list, renditions, encoder="cpu"
+                )
+            
             logger.error(f"FFmpeg watermark error: {stderr.decode()}")
             raise Exception("Failed to apply watermark")
             
     except Exception as e:
         logger.error(f"Error applying watermark: {e}")
         raise
+    finally:
+        # Remove the filter script
+        if filter_script.exists():
+            filter_script.unlink()
 
 async def merge_videos(video_paths, user_id):
     """Merge multiple videos and apply watermark to the final result."""
     # Create user-specific directory if it doesn't exist
-    user_dir = TEMP_DIR / str(user_id)
-    user_dir.mkdir(exist_ok=True)
+    user_dir = _user_dir(user_id)
     
-    # Create a list file for ffmpeg
-    list_file = user_dir / f"list_{uuid.uuid4()}.txt"
-    merged_path = user_dir / f"merged_{uuid.uuid4()}.mp4"
     watermarked_path = user_dir / f"watermarked_{uuid.uuid4()}.mp4"
+    _track_file(user_id, watermarked_path)
+    
+    # Build the concat list, fed to ffmpeg over stdin
+    concat_list = "".join(f"file '{os.path.abspath(path)}'\n" for path in video_paths).encode()
     
     try:
-        # Create the list file for ffmpeg concat
-        with open(list_file, "w") as f:
-            for path in video_paths:
-                f.write(f"file '{os.path.abspath(path)}'\n")
-        
-        # Merge videos
         logger.info(f"Merging {len(video_paths)} videos for user {user_id}")
-        merge_cmd = [
-            "ffmpeg", 
-            "-f", "concat", 
-            "-safe", "0", 
-            "-i", str(list_file), 
-            "-c", "copy",
-            "-y",  # Overwrite output files without asking
-            str(merged_path)
-        ]
         
-        merge_process = await asyncio.create_subprocess_exec(
-            *merge_cmd,
-            stdout=asyncio.subprocess.PIPE,
-            stderr=asyncio.subprocess.PIPE
-        )
+        # Inputs with matching codec parameters can be concatenated and
+        # watermarked in one pass without an intermediate merged file
+        stream_params = await uniform_stream_params(video_paths)
+        if stream_params:
+            await apply_watermark(
+                "pipe:0", str(watermarked_path), concat_list=concat_list, stream_params=stream_params
+            )
+            return str(watermarked_path)
         
-        stdout, stderr = await merge_process.communicate()
+        logger.info(f"Input streams differ for user {user_id}, merging in two steps")
+        merged_path = user_dir / f"merged_{uuid.uuid4()}.mp4"
         
-        if merge_process.returncode != 0:
-            logger.error(f"FFmpeg merge error: {stderr.decode()}")
-            raise Exception("Failed to merge videos")
-        
-        # Apply watermark to the merged video
-        await apply_watermark(str(merged_path), str(watermarked_path))
+        try:
+            # Merge videos
+            merge_cmd = [
+                "ffmpeg", 
+                *CONCAT_INPUT_ARGS,
+                "-i", "pipe:0", 
+                "-c", "copy",
+                "-y",  # Overwrite output files without asking
+                str(merged_path)
+            ]
+            
+            async with _ENCODE_SEM:
+                merge_process = await asyncio.create_subprocess_exec(
+                    *merge_cmd,
+                    stdin=asyncio.subprocess.PIPE,
+                    stdout=asyncio.subprocess.PIPE,
+                    stderr=asyncio.subprocess.PIPE
+                )
+                
+                stdout, stderr = await merge_process.communicate(input=concat_list)
+            
+            if merge_process.returncode != 0:
+                logger.error(f"FFmpeg merge error: {stderr.decode()}")
+                raise Exception("Failed to merge videos")
+            
+            # Apply watermark to the merged video
+            await apply_watermark(str(merged_path), str(watermarked_path))
+        finally:
+            # Remove the intermediate merged file
+            if merged_path.exists():
+                merged_path.unlink()
         
         return str(watermarked_path)
         
     except Exception as e:
         logger.error(f"Error in merge_videos: {e}")
+        
+        # Don't leave a partial output behind
+        clean_user_videos(user_id, [], watermarked_path)
         raise
-    finally:
-        # Remove the list file
-        if list_file.exists():
-            list_file.unlink()
+
+# Shared pool for deleting temp files off the event loop
+_CLEANUP_EXECUTOR = ThreadPoolExecutor(max_workers=8, thread_name_prefix="cleanup")
+
+def _safe_unlink(path):
+    """Remove a file, ignoring files that are already gone."""
+    try:
+        os.remove(path)
+        logger.info(f"Removed temporary file: {path}")
+    except FileNotFoundError:
+        pass
+    except OSError as e:
+        logger.error(f"Could not remove {path}: {e}")
 
 def clean_user_videos(user_id, video_paths, result_path=None):
-    """Clean up temporary video files for a user."""
+    """Clean up temporary video files for a user.
+    
+    Bookkeeping happens immediately; the files themselves are unlinked in the
+    background so callers on the event loop never wait on the filesystem.
+    """
+    tracked = user_files.get(user_id)
+    
+    # Nothing has been created since the last cleanup
+    if not tracked:
+        return
+    
     try:
-        # Delete individual video files
-        for path in video_paths:
-            if os.path.exists(path):
-                os.remove(path)
-                logger.info(f"Removed video file: {path}")
-        
-        # Delete the result file if provided
-        if result_path and os.path.exists(result_path):
-            os.remove(result_path)
-            logger.info(f"Removed result file: {result_path}")
-            
-        # Try to remove any other temporary files in the user's directory
-        user_dir = TEMP_DIR / str(user_id)
-        if user_dir.exists():
-            for file in user_dir.glob("*"):
-                try:
-                    file.unlink()
-                    logger.info(f"Removed temporary file: {file}")
-                except:
-                    pass
+        # Delete only the caller's files; videos uploaded since stay tracked
+        paths = {str(path) for path in video_paths}
+        if result_path:
+            paths.add(str(result_path))
+        
+        tracked.difference_update(paths)
+        if not tracked:
+            del user_files[user_id]
+            _created_dirs.discard(user_id)
+        
+        for path in paths:
+            _probe_cache.pop(path, None)
+        
+        # Issue the unlinks concurrently so their latency overlaps on network storage
+        for path in paths:
+            _CLEANUP_EXECUTOR.submit(_safe_unlink, path)
     except Exception as e:
         logger.error(f"Error cleaning up user videos: {e}")